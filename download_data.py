@@ -1,21 +1,53 @@
+import asyncio
+import aiohttp
+import argparse
 import requests
-import json
-from datetime import datetime
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import bisect
+from datetime import datetime, timedelta
+from multiprocessing import Pool
 import os
-import pandas as pd
+import sys
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as papq
 from tqdm import tqdm
-from utils import setup_logging, validate_org_data
+from utils import setup_logging, validate_org_data, as_list
 
 logger = setup_logging()
 
+DATA_DIR = Path("data")
+
 class ODSClient:
     def __init__(self):
         self.base_url = "https://directory.spineservices.nhs.uk/ORD/2-0-0"
-        self.headers = {"Accept": "application/json"}
+        self.session = requests_cache.CachedSession(
+            cache_name=str(DATA_DIR / 'ods_cache'),
+            backend='sqlite',
+            expire_after=timedelta(hours=6)
+        )
+        self.session.headers.update({"Accept": "application/json"})
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True
+        )
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=32,
+            max_retries=retries
+        ))
 
     def get_related_orgs(self, ods_code):
         """Get all organisations related to the given ODS code using API pagination"""
         all_orgs = []
+        idx = 0
         current_url = f"{self.base_url}/organisations"
         first_request = True
         params = {
@@ -25,28 +57,34 @@ class ODSClient:
         }
         
         try:
-            response = requests.get(current_url, params=params, headers=self.headers)
+            response = self.session.get(current_url, params=params)
             response.raise_for_status()
             total_count = int(response.headers.get('X-Total-Count', 0))
             
             logger.info(f"Found {total_count} organisations to process")
             
+            # The total is known up front, so preallocate rather than
+            # growing the list page by page
+            all_orgs = [None] * total_count
+            
             # Create progress bar
-            pbar = tqdm(total=total_count, desc="Retrieving organisations")
+            pbar = tqdm(total=total_count, desc="Retrieving organisations",
+                        mininterval=0.5, disable=not sys.stderr.isatty())
             
             while True:
                 if first_request:
-                    orgs = response.json().get("Organisations", [])
+                    orgs = orjson.loads(response.content).get("Organisations", [])
                     first_request = False
                 else:
-                    response = requests.get(current_url, headers=self.headers)
+                    response = self.session.get(current_url)
                     response.raise_for_status()
-                    orgs = response.json().get("Organisations", [])
+                    orgs = orjson.loads(response.content).get("Organisations", [])
                 
                 if not orgs:
                     break
                     
-                all_orgs.extend(orgs)
+                all_orgs[idx:idx + len(orgs)] = orgs
+                idx += len(orgs)
                 pbar.update(len(orgs))
                 
                 next_page = response.headers.get('next-page')
@@ -65,6 +103,8 @@ class ODSClient:
             if 'pbar' in locals():
                 pbar.close()
         
+        # Trim unfilled slots if the reported total overshot
+        del all_orgs[idx:]
         return all_orgs
 
     def get_org_details(self, ods_code):
@@ -73,9 +113,9 @@ class ODSClient:
         params = {"_format": "json"}
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
+            response = self.session.get(url, params=params)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Validate organization data
             if not validate_org_data(data.get("Organisation", {})):
@@ -86,18 +126,57 @@ class ODSClient:
             logger.error(f"Error getting organisation details for {ods_code}: {e}")
             return None
 
-def save_raw_data(data, filename):
-    """Save raw data to JSON file"""
-    try:
-        os.makedirs("data", exist_ok=True)
-        filepath = os.path.join("data", filename)
-        
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
-        
-        logger.info(f"Raw data saved to {filepath}")
-    except Exception as e:
-        logger.error(f"Error saving raw data: {e}")
+class AsyncODSClient:
+    """Async variant of ODSClient for fetching organisation details concurrently"""
+    def __init__(self, max_concurrency=16, max_attempts=5):
+        self.base_url = "https://directory.spineservices.nhs.uk/ORD/2-0-0"
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch_details(self, session, ods_code):
+        """Async equivalent of ODSClient.get_org_details"""
+        url = f"{self.base_url}/organisations/{ods_code}"
+        params = {"_format": "json"}
+
+        async with self.semaphore:
+            for attempt in range(self.max_attempts):
+                try:
+                    async with session.get(url, params=params,
+                                           timeout=aiohttp.ClientTimeout(total=10)) as response:
+                        response.raise_for_status()
+                        # Every field of the payload is persisted to data/, so the
+                        # document has to be materialised in full here; a lazy
+                        # key-only parser would not save any work.
+                        data = orjson.loads(await response.read())
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt == self.max_attempts - 1:
+                        logger.error(f"Error getting organisation details for {ods_code}: {e}")
+                        return None
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+
+        # Validate organization data
+        if not validate_org_data(data.get("Organisation", {})):
+            logger.warning(f"Invalid organization data for {ods_code}")
+
+        return data
+
+    async def fetch_all_details(self, ods_codes):
+        """Fetch details for all ODS codes concurrently"""
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector,
+                                         headers={"Accept": "application/json"}) as session:
+            tasks = [self.fetch_details(session, ods_code) for ods_code in ods_codes]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+def _dig(d, *path, default=None):
+    """Walk a nested dict path without allocating intermediate defaults"""
+    for key in path:
+        d = d.get(key) if isinstance(d, dict) else None
+        if d is None:
+            return default
+    return d
 
 def extract_practice_data(org_data):
     """Extract relevant GP Practice data"""
@@ -107,36 +186,44 @@ def extract_practice_data(org_data):
         if not isinstance(roles, list):
             roles = [roles]
         
-        if not any(role.get("id") == "RO76" for role in roles):
+        role_ids = {role.get("id") for role in roles}
+        if "RO76" not in role_ids:
             return None
-            
-        # Get dates
-        dates = org_info.get("Date", [])
-        if not isinstance(dates, list):
-            dates = [dates]
-        
-        # Get PCN relationship
-        rels = org_info.get("Rels", {}).get("Rel", [])
-        if not isinstance(rels, list):
-            rels = [rels]
-        
-        pcn_rel = next((rel for rel in rels 
-                        if rel.get("Target", {}).get("PrimaryRoleId", {}).get("id") == "RO272"
-                        and rel.get("Status") == "Active"
-                        and not any(d.get("End") for d in rel.get("Date", []))), None)
-        
-        location = org_info.get("GeoLoc", {}).get("Location", {})
-        
+
+        # Single pass over the dates for the operational window
+        dates = as_list(org_info.get("Date"))
+
+        op_start = op_end = None
+        for d in dates:
+            if d.get("Type") == "Operational":
+                op_start = d.get("Start")
+                op_end = d.get("End")
+                break
+
+        # Single pass over the relationships for the active PCN
+        rels = as_list(_dig(org_info, "Rels", "Rel"))
+
+        pcn_code = None
+        active_pcn_rels = [rel for rel in rels
+                           if rel.get("Status") == "Active"
+                           and _dig(rel, "Target", "PrimaryRoleId", "id") == "RO272"]
+        for rel in active_pcn_rels:
+            if not any(d.get("End") for d in rel.get("Date", [])):
+                pcn_code = _dig(rel, "Target", "OrgId", "extension")
+                break
+
+        location = _dig(org_info, "GeoLoc", "Location", default={})
+
         return {
-            'ODS Code': org_info.get("OrgId", {}).get("extension"),
+            'ODS Code': _dig(org_info, "OrgId", "extension"),
             'Name': org_info.get("Name"),
             'Status': org_info.get("Status"),
-            'Operational Start': next((d.get("Start") for d in dates if d.get("Type") == "Operational"), None),
-            'Operational End': next((d.get("End") for d in dates if d.get("Type") == "Operational"), None),
+            'Operational Start': op_start,
+            'Operational End': op_end,
             'Address': location.get("AddrLn1"),
             'Town': location.get("Town"),
             'Postcode': location.get("PostCode"),
-            'Current PCN Code': pcn_rel.get("Target", {}).get("OrgId", {}).get("extension") if pcn_rel else None,
+            'Current PCN Code': pcn_code,
             'Last Changed': org_info.get("LastChangeDate")
         }
     except Exception as e:
@@ -147,17 +234,15 @@ def extract_pcn_data(org_data):
     """Extract relevant PCN data"""
     try:
         org_info = org_data.get("Organisation", {})
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
+        roles = as_list(_dig(org_info, "Roles", "Role"))
         
         if not any(role.get("id") == "RO272" and role.get("primaryRole", False) for role in roles):
             return None
         
-        location = org_info.get("GeoLoc", {}).get("Location", {})
+        location = _dig(org_info, "GeoLoc", "Location", default={})
         
         return {
-            'ODS Code': org_info.get("OrgId", {}).get("extension"),
+            'ODS Code': _dig(org_info, "OrgId", "extension"),
             'Name': org_info.get("Name"),
             'Status': org_info.get("Status"),
             'Address': location.get("AddrLn1"),
@@ -169,71 +254,111 @@ def extract_pcn_data(org_data):
         logger.error(f"Error extracting PCN data: {e}")
         return None
 
-def main():
+def extract_org_data(org_details):
+    """Run both extractors over one organisation record (Pool worker)"""
+    return extract_practice_data(org_details), extract_pcn_data(org_details)
+
+async def main_async(force_refresh=False):
     try:
+        # Created once here; everything below assumes the directory exists
+        os.makedirs(DATA_DIR, exist_ok=True)
+
         # Initialize the ODS client
         client = ODSClient()
-        
+        if force_refresh:
+            logger.info("Clearing cached ODS responses")
+            client.session.cache.clear()
+
         # North Central London ICB ODS code
         icb_code = "93C"
-        
+
         # Get all related organizations
         related_orgs = client.get_related_orgs(icb_code)
         logger.info(f"Found {len(related_orgs)} organisations")
-        
-        # Get full details for each organization
-        full_data = {
-            "metadata": {
-                "icb_code": icb_code,
-                "download_date": datetime.now().isoformat(),
-                "total_organisations": len(related_orgs)
-            },
-            "organisations": {}
+
+        metadata = {
+            "icb_code": icb_code,
+            "download_date": datetime.now().isoformat(),
+            "total_organisations": len(related_orgs)
         }
-        
-        practices_data = []
-        pcns_data = []
-        
+
+        ods_codes = [org.get("OrgId") for org in related_orgs if org.get("OrgId")]
+        async_client = AsyncODSClient()
+        results = await async_client.fetch_all_details(ods_codes)
+
+        # Stream each organisation straight to disk as JSON Lines so the
+        # full dataset never has to be held and pretty-printed in one go
+        timestamp = datetime.now().strftime("%Y%m%d")
+        data_path = DATA_DIR / f"ncl_icb_data_{timestamp}.jsonl"
+
         logger.info("Processing organisations...")
-        for org in tqdm(related_orgs):
-            ods_code = org.get("OrgId")
-            if ods_code:
-                org_details = client.get_org_details(ods_code)
+        with open(data_path, 'wb') as f:
+            f.write(orjson.dumps({"metadata": metadata}) + b"\n")
+            for ods_code, org_details in tqdm(zip(ods_codes, results), total=len(ods_codes),
+                                              mininterval=0.5,
+                                              miniters=max(1, len(ods_codes) // 100),
+                                              disable=not sys.stderr.isatty()):
+                if isinstance(org_details, Exception):
+                    logger.error(f"Error getting organisation details for {ods_code}: {org_details}")
+                    continue
                 if org_details:
-                    full_data["organisations"][ods_code] = org_details
-                    
-                    # Extract practice data if applicable
-                    practice_data = extract_practice_data(org_details)
-                    if practice_data:
-                        practices_data.append(practice_data)
-                    
-                    # Extract PCN data if applicable
-                    pcn_data = extract_pcn_data(org_details)
-                    if pcn_data:
-                        pcns_data.append(pcn_data)
-        
-        # Save raw data
-        timestamp = datetime.now().strftime("%Y%m%d")
-        json_filename = f"ncl_icb_data_{timestamp}.json"
-        save_raw_data(full_data, json_filename)
-        
+                    f.write(orjson.dumps({"ods_code": ods_code, "data": org_details}) + b"\n")
+
+        logger.info(f"Raw data saved to {data_path}")
+
+        # Extraction is pure dict walking, so run it over the file just
+        # written with a process pool instead of inline with the fetch.
+        # Rows arrive unordered from the pool and are kept in output order
+        # as they land, so no sort (or DataFrame) is needed at the end.
+        practice_fields = ('ODS Code', 'Name', 'Status', 'Operational Start',
+                           'Operational End', 'Address', 'Town', 'Postcode',
+                           'Current PCN Code', 'Last Changed')
+        pcn_fields = ('ODS Code', 'Name', 'Status', 'Address', 'Town',
+                      'Postcode', 'Last Changed')
+        practice_rows = []  # ordered by (Status, Name)
+        pcn_rows = []  # ordered by Name
+
+        logger.info("Extracting practice and PCN data...")
+        with open(data_path, 'rb') as f, Pool() as pool:
+            next(f)  # metadata line
+            records = (orjson.loads(line)["data"] for line in f)
+            for practice_data, pcn_data in pool.imap_unordered(extract_org_data, records,
+                                                               chunksize=64):
+                if practice_data:
+                    bisect.insort(practice_rows,
+                                  tuple(practice_data[key] for key in practice_fields),
+                                  key=lambda row: (row[2] or '', row[1] or ''))
+                if pcn_data:
+                    bisect.insort(pcn_rows,
+                                  tuple(pcn_data[key] for key in pcn_fields),
+                                  key=lambda row: row[1] or '')
+
         # Save CSVs
-        os.makedirs("data", exist_ok=True)
         
-        if practices_data:
-            practices_df = pd.DataFrame(practices_data)
-            practices_df.sort_values(['Status', 'Name'], inplace=True)
-            practices_df.to_csv('data/practices.csv', index=False)
-            logger.info(f"Saved {len(practices_data)} practices to practices.csv")
+        if practice_rows:
+            columns = zip(*practice_rows)
+            practices_table = pa.table(dict(zip(practice_fields, (list(c) for c in columns))))
+            pacsv.write_csv(practices_table, DATA_DIR / 'practices.csv')
+            papq.write_table(practices_table, DATA_DIR / 'practices.parquet')
+            logger.info(f"Saved {len(practice_rows)} practices to practices.csv")
         
-        if pcns_data:
-            pcns_df = pd.DataFrame(pcns_data)
-            pcns_df.sort_values('Name', inplace=True)
-            pcns_df.to_csv('data/pcns.csv', index=False)
-            logger.info(f"Saved {len(pcns_data)} PCNs to pcns.csv")
+        if pcn_rows:
+            columns = zip(*pcn_rows)
+            pcns_table = pa.table(dict(zip(pcn_fields, (list(c) for c in columns))))
+            pacsv.write_csv(pcns_table, DATA_DIR / 'pcns.csv')
+            papq.write_table(pcns_table, DATA_DIR / 'pcns.parquet')
+            logger.info(f"Saved {len(pcn_rows)} PCNs to pcns.csv")
             
     except Exception as e:
         logger.error(f"Error in main execution: {e}")
 
+def main():
+    parser = argparse.ArgumentParser(description="Download ODS data for the ICB")
+    parser.add_argument('--force-refresh', action='store_true',
+                        help="Clear cached ODS responses before fetching")
+    args = parser.parse_args()
+
+    asyncio.run(main_async(force_refresh=args.force_refresh))
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,149 +1,225 @@
-import requests
+import argparse
+import asyncio
+import aiohttp
 import json
+import orjson
+from dataclasses import dataclass
 from datetime import datetime
 import os
 import pandas as pd
 from tqdm import tqdm
 from collections import defaultdict
+from operator import itemgetter
+from utils import as_list, load_ods_data
+
+# Bump to invalidate cached organisation details after schema changes
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join("data", "org_cache")
 
 class ODSClient:
-    def __init__(self):
+    def __init__(self, max_concurrency=64, max_attempts=5):
         self.base_url = "https://directory.spineservices.nhs.uk/ORD/2-0-0"
         self.headers = {"Accept": "application/json"}
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.semaphore = asyncio.Semaphore(max_concurrency)
 
-    def get_related_orgs(self, ods_code):
-        """Get all organisations related to the given ODS code using API pagination"""
-        all_orgs = []
-        current_url = f"{self.base_url}/organisations"
-        first_request = True
+    def _connector(self):
+        return aiohttp.TCPConnector(limit_per_host=self.max_concurrency)
+
+    async def _get(self, session, url, params=None):
+        """GET with exponential-backoff retry on errors and timeouts"""
+        async with self.semaphore:
+            for attempt in range(self.max_attempts):
+                try:
+                    async with session.get(url, params=params,
+                                           timeout=aiohttp.ClientTimeout(total=10)) as response:
+                        response.raise_for_status()
+                        return await response.read(), response.headers
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt == self.max_attempts - 1:
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def _gather_pages(self, session, url, params, page_size, total_count):
+        """Fetch pages 2..N concurrently using Limit/Offset"""
+        orgs = []
+        requests = [
+            self._get(session, url, dict(params, Limit=page_size, Offset=offset))
+            for offset in range(page_size, total_count, page_size)
+        ]
+        for body, _ in await asyncio.gather(*requests):
+            orgs.extend(json.loads(body).get("Organisations", []))
+        return orgs
+
+    async def _walk_pages(self, session, next_page):
+        """Follow next-page links one at a time (sequential fallback)"""
+        orgs = []
+        while next_page:
+            body, headers = await self._get(session, next_page)
+            page = json.loads(body).get("Organisations", [])
+            if not page:
+                break
+            orgs.extend(page)
+            next_page = headers.get('next-page')
+        return orgs
+
+    async def _get_org_list(self, session, params):
+        """Fetch the full organisation list from the paginated endpoint"""
+        url = f"{self.base_url}/organisations"
+        body, headers = await self._get(session, url, params)
+        total_count = int(headers.get('X-Total-Count', 0))
+        first_page = json.loads(body).get("Organisations", [])
+        next_page = headers.get('next-page')
+        print(f"Retrieving {total_count} organisations")
+
+        if not first_page or not next_page:
+            return first_page
+
+        # The total and page size are known after the first response, so
+        # the remaining pages can be requested by offset in parallel; fall
+        # back to walking next-page links if the API rejects Offset.
+        try:
+            rest = await self._gather_pages(session, url, params,
+                                            len(first_page), total_count)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            rest = await self._walk_pages(session, next_page)
+
+        return first_page + rest
+
+    async def _get_related_orgs(self, session, ods_code):
         params = {
             "RelTypeId": "RE2,RE3,RE4,RE5,RE6,RE7,RE8,RE9,RE10,RE11",
             "TargetOrgId": ods_code,
             "_format": "json"
         }
-        
-        # Make first request to get total count
+
         try:
-            response = requests.get(current_url, params=params, headers=self.headers)
-            response.raise_for_status()
-            total_count = int(response.headers.get('X-Total-Count', 0))
-            
-            # Create progress bar
-            pbar = tqdm(total=total_count, desc="Retrieving organisations")
-            
-            while True:
-                if first_request:
-                    orgs = response.json().get("Organisations", [])
-                    first_request = False
-                else:
-                    response = requests.get(current_url, headers=self.headers)
-                    response.raise_for_status()
-                    orgs = response.json().get("Organisations", [])
-                
-                if not orgs:
-                    break
-                    
-                all_orgs.extend(orgs)
-                pbar.update(len(orgs))
-                
-                next_page = response.headers.get('next-page')
-                if not next_page:
-                    break
-                    
-                current_url = next_page
-                
-        except requests.exceptions.RequestException as e:
+            return await self._get_org_list(session, params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"Error getting related organisations: {e}")
-            if 'response' in locals():
-                print(f"Response status code: {response.status_code}")
-                print(f"Response headers: {response.headers}")
-                print(f"Response content: {response.text[:500]}...")
-        finally:
-            if 'pbar' in locals():
-                pbar.close()
-        
-        return all_orgs
-
-    def get_org_details(self, ods_code):
+            return []
+
+    def get_related_orgs(self, ods_code):
+        """Get all organisations related to the given ODS code using API pagination"""
+        async def run():
+            async with aiohttp.ClientSession(connector=self._connector(),
+                                             headers=self.headers) as session:
+                return await self._get_related_orgs(session, ods_code)
+
+        return asyncio.run(run())
+
+    async def get_org_details(self, session, ods_code):
         """Get full details for a specific organization using the organization endpoint"""
         url = f"{self.base_url}/organisations/{ods_code}"
-        params = {"_format": "json"}
-        
+
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            body, _ = await self._get(session, url, {"_format": "json"})
+            return json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"Error getting organisation details for {ods_code}: {e}")
             return None
 
-    def get_practices_and_pcns(self, icb_code):
-        """Get all GP Practices and PCNs for specific ICB"""
-        url = f"{self.base_url}/organisations"
+    def _cache_path(self, ods_code):
+        return os.path.join(CACHE_DIR, f"{ods_code}.json")
+
+    def _read_cached_details(self, ods_code, last_change_date):
+        """Return cached details when the list entry's LastChangeDate matches"""
+        try:
+            with open(self._cache_path(ods_code)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("cache_version") != CACHE_VERSION:
+            return None
+        if not last_change_date or entry.get("last_change_date") != last_change_date:
+            return None
+        return entry.get("data")
+
+    def _write_cached_details(self, ods_code, last_change_date, data):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(self._cache_path(ods_code), 'w') as f:
+                json.dump({
+                    "cache_version": CACHE_VERSION,
+                    "last_change_date": last_change_date,
+                    "data": data
+                }, f)
+        except OSError as e:
+            print(f"Could not cache details for {ods_code}: {e}")
+
+    async def _get_practices_and_pcns(self, icb_code):
         params = {
             "RelTypeId": "RE4,RE6",  # IS COMMISSIONED BY, IS OPERATED BY
             "TargetOrgId": icb_code,  # Filter for specific ICB
             "_format": "json"
         }
-        
-        all_orgs = []
-        try:
-            response = requests.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-            total_count = int(response.headers.get('X-Total-Count', 0))
-            
-            with tqdm(total=total_count, desc="Retrieving organisations") as pbar:
-                while True:
-                    orgs = response.json().get("Organisations", [])
-                    if not orgs:
-                        break
-                    
-                    all_orgs.extend(orgs)
-                    pbar.update(len(orgs))
-                    
-                    next_page = response.headers.get('next-page')
-                    if not next_page:
-                        break
-                    
-                    response = requests.get(next_page, headers=self.headers)
-                    response.raise_for_status()
-            
-            # Get full details and filter for practices and PCNs
-            details = {}
-            for org in tqdm(all_orgs, desc="Getting organisation details"):
+
+        async with aiohttp.ClientSession(connector=self._connector(),
+                                         headers=self.headers) as session:
+            try:
+                all_orgs = await self._get_org_list(session, params)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error getting organisations: {e}")
+                return {}
+
+            # ODS records change rarely, so serve details from the disk
+            # cache whenever the list entry's LastChangeDate still matches,
+            # and only fetch the orgs that actually changed.
+            fetched = {}
+            to_fetch = []
+            for org in all_orgs:
                 ods_code = org.get("OrgId")
-                if ods_code:
-                    org_details = self.get_org_details(ods_code)
-                    if org_details:
-                        org_info = org_details.get("Organisation", {})
-                        roles = org_info.get("Roles", {}).get("Role", [])
-                        if not isinstance(roles, list):
-                            roles = [roles]
-                        
-                        # Only include if it's a practice or PCN
-                        if any(role.get("id") in ["RO76", "RO272"] for role in roles):
-                            details[ods_code] = org_details
-            
+                if not ods_code:
+                    continue
+                cached = self._read_cached_details(ods_code, org.get("LastChangeDate"))
+                if cached is not None:
+                    fetched[ods_code] = cached
+                else:
+                    to_fetch.append((ods_code, org.get("LastChangeDate")))
+
+            if fetched:
+                print(f"Loaded {len(fetched)} organisations from cache")
+
+            # Get full details and filter for practices and PCNs.
+            # The detail calls are independent, so fan them out concurrently
+            # rather than paying one round trip per org.
+            results = await asyncio.gather(
+                *[self.get_org_details(session, ods_code) for ods_code, _ in to_fetch])
+            for (ods_code, last_change_date), org_details in zip(to_fetch, results):
+                if org_details:
+                    self._write_cached_details(ods_code, last_change_date, org_details)
+                    fetched[ods_code] = org_details
+
+            details = {}
+            for ods_code, org_details in tqdm(fetched.items(), total=len(fetched),
+                                              desc="Getting organisation details"):
+                if org_details:
+                    org_info = org_details.get("Organisation", {})
+                    roles = as_list(org_info.get("Roles", {}).get("Role"))
+
+                    # Only include if it's a practice or PCN
+                    role_ids = {role.get("id") for role in roles}
+                    if role_ids & {"RO76", "RO272"}:
+                        details[ods_code] = org_details
+
             return details
-                
-        except requests.exceptions.RequestException as e:
-            print(f"Error getting organisations: {e}")
-            if 'response' in locals():
-                print(f"Response status code: {response.status_code}")
-                print(f"Response headers: {response.headers}")
-                print(f"Response content: {response.text[:500]}...")
-            return {}
+
+    def get_practices_and_pcns(self, icb_code):
+        """Get all GP Practices and PCNs for specific ICB"""
+        return asyncio.run(self._get_practices_and_pcns(icb_code))
 
 def load_or_fetch_data(icb_code):
     """Load existing data for today or fetch new data if none exists"""
     today = datetime.now().strftime("%Y%m%d")
-    json_filename = f"ncl_icb_data_{today}.json"
-    json_path = os.path.join("data", json_filename)
+    data_path = os.path.join("data", f"ncl_icb_data_{today}.jsonl")
+    legacy_path = os.path.join("data", f"ncl_icb_data_{today}.json")
     
-    if os.path.exists(json_path):
-        print(f"Loading existing data from {json_filename}")
-        with open(json_path, 'r') as f:
-            return json.load(f)
+    for path in (data_path, legacy_path):
+        if os.path.exists(path):
+            print(f"Loading existing data from {os.path.basename(path)}")
+            return load_ods_data(path)
     
     print("No existing data found for today, fetching new data...")
     client = ODSClient()
@@ -151,405 +227,452 @@ def load_or_fetch_data(icb_code):
     # Get practices and PCNs
     organisations = client.get_practices_and_pcns(icb_code)
     
-    full_data = {
-        "metadata": {
-            "icb_code": icb_code,
-            "download_date": datetime.now().isoformat(),
-            "total_organisations": len(organisations)
-        },
-        "organisations": organisations
+    metadata = {
+        "icb_code": icb_code,
+        "download_date": datetime.now().isoformat(),
+        "total_organisations": len(organisations)
     }
     
-    # Save the data
+    # Save as JSON Lines: metadata first, then one organisation per line,
+    # so neither save nor load ever builds one giant document string
     os.makedirs("data", exist_ok=True)
-    with open(json_path, 'w') as f:
-        json.dump(full_data, f, indent=2)
+    with open(data_path, 'wb') as f:
+        f.write(orjson.dumps({"metadata": metadata}) + b"\n")
+        for ods_code, org_details in organisations.items():
+            f.write(orjson.dumps({"ods_code": ods_code, "data": org_details}) + b"\n")
     
-    return full_data
+    return {"metadata": metadata, "organisations": organisations}
+
+@dataclass
+class OrgRecord:
+    """One organisation with its repeating sections normalised to lists"""
+    ods_code: str
+    org_info: dict
+    name: str
+    status: str
+    last_changed: str
+    roles: list
+    role_ids: set
+    primary_role_ids: set
+    dates: list
+    rels: list
+    contacts: list
+
+@dataclass
+class Index:
+    """Single-pass indexes over the organisations in a data file"""
+    orgs: list
+    by_code: dict
+    practices: list
+    pcns: list
+
+def build_indexes(data):
+    """Classify and normalise every organisation in a single pass
+
+    The analyzers and the report all need the same role checks and
+    list normalisation, so do that work once here instead of once per
+    consumer.
+    """
+    index = Index(orgs=[], by_code={}, practices=[], pcns=[])
+
+    for ods_code, org_data in data.get("organisations", {}).items():
+        org_info = org_data.get("Organisation", {})
+        roles = as_list(org_info.get("Roles", {}).get("Role"))
+
+        record = OrgRecord(
+            ods_code=ods_code,
+            org_info=org_info,
+            name=org_info.get("Name"),
+            status=org_info.get("Status"),
+            last_changed=org_info.get("LastChangeDate"),
+            roles=roles,
+            role_ids={role.get("id") for role in roles},
+            primary_role_ids={role.get("id") for role in roles if role.get("primaryRole", False)},
+            dates=as_list(org_info.get("Date")),
+            rels=as_list(org_info.get("Rels", {}).get("Rel")),
+            contacts=as_list(org_info.get("Contacts", {}).get("Contact"))
+        )
+        index.orgs.append(record)
+        index.by_code[ods_code] = record
+
+        if "RO76" in record.role_ids:
+            index.practices.append(record)
+        if "RO272" in record.primary_role_ids:
+            index.pcns.append(record)
+
+    return index
+
+PRACTICE_COLUMNS = [
+    'ODS Code', 'Name', 'Status', 'Primary Role', 'Operational Start',
+    'Operational End', 'Legal Start', 'Legal End', 'Address', 'Address Line 2',
+    'Town', 'County', 'Postcode', 'UPRN', 'Phone', 'Current PCN',
+    'Current PCN Code', 'PCN Member Since', 'PCN History', 'Last Changed'
+]
+
+PCN_COLUMNS = [
+    'ODS Code', 'Name', 'Status', 'Operational Start', 'Operational End',
+    'Legal Start', 'Legal End', 'Address', 'Town', 'Postcode', 'UPRN',
+    'Number of Member Practices', 'Member Practices', 'Last Changed'
+]
+
+def _dates_by_type(dates):
+    """Map date Type -> first date entry of that type"""
+    by_type = {}
+    for d in dates:
+        if isinstance(d, dict):
+            by_type.setdefault(d.get("Type"), d)
+    return by_type
 
-def create_practice_pcn_report(data, filename):
-    """Create Excel report focusing on GP Practices and PCNs"""
-    if not data.get("organisations"):
+def _roles_by_id(roles):
+    """Map role id -> first role entry with that id"""
+    by_id = {}
+    for role in roles:
+        by_id.setdefault(role.get("id"), role)
+    return by_id
+
+def create_practice_pcn_report(index, timestamp, excel=False):
+    """Create the practice/PCN report as parquet files, optionally with Excel"""
+    if not index.orgs:
         print("No organization data available to create report")
         return
-        
-    excel_path = os.path.join("data", filename)
-    writer = pd.ExcelWriter(excel_path, engine='openpyxl')
     
     practices = []
     pcns = {}  # Use dict for easier lookup
+    # PCN membership is known up front from the index, so practices and
+    # PCNs can be handled in one fused pass regardless of encounter order
+    pcn_codes = {record.ods_code for record in index.pcns}
+    # Member lists are shared with the pcns entries via defaultdict, so a
+    # practice may register with a PCN processed later in the same pass
+    pcn_members = defaultdict(list)
     
     print("Processing organisations...")
-    # First identify all PCNs
-    for ods_code, org_data in tqdm(data["organisations"].items(), desc="Identifying PCNs"):
-        org_info = org_data.get("Organisation", {})
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
-        
-        if any(role.get("id") == "RO272" and role.get("primaryRole", False) for role in roles):
-            location = org_info.get("GeoLoc", {}).get("Location", {})
-            dates = org_info.get("Date", [])
-            if not isinstance(dates, list):
-                dates = [dates]
-            
+    for record in tqdm(index.orgs, desc="Processing organisations"):
+        is_pcn = record.ods_code in pcn_codes
+        is_practice = "RO76" in record.role_ids
+        if not (is_pcn or is_practice):
+            continue
+
+        ods_code = record.ods_code
+        org_info = record.org_info
+        location = org_info.get("GeoLoc", {}).get("Location", {})
+        dates_by_type = _dates_by_type(record.dates)
+        operational = dates_by_type.get("Operational", {})
+        legal = dates_by_type.get("Legal", {})
+
+        if is_pcn:
             pcns[ods_code] = {
-                'name': org_info.get("Name"),
-                'status': org_info.get("Status"),
-                'operational_start': next((d.get("Start") for d in dates if d.get("Type") == "Operational"), None),
-                'operational_end': next((d.get("End") for d in dates if d.get("Type") == "Operational"), None),
-                'legal_start': next((d.get("Start") for d in dates if d.get("Type") == "Legal"), None),
-                'legal_end': next((d.get("End") for d in dates if d.get("Type") == "Legal"), None),
+                'name': record.name,
+                'status': record.status,
+                'operational_start': operational.get("Start"),
+                'operational_end': operational.get("End"),
+                'legal_start': legal.get("Start"),
+                'legal_end': legal.get("End"),
                 'address': location.get("AddrLn1"),
                 'town': location.get("Town"),
                 'postcode': location.get("PostCode"),
                 'uprn': location.get("UPRN"),
-                'member_practices': [],
-                'last_changed': org_info.get("LastChangeDate")
+                'member_practices': pcn_members[ods_code],
+                'last_changed': record.last_changed
             }
-    
-    # Process GP Practices
-    for ods_code, org_data in tqdm(data["organisations"].items(), desc="Processing GP Practices"):
-        org_info = org_data.get("Organisation", {})
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
-        
-        if any(role.get("id") == "RO76" for role in roles):
-            location = org_info.get("GeoLoc", {}).get("Location", {})
-            dates = org_info.get("Date", [])
-            if not isinstance(dates, list):
-                dates = [dates]
-            
-            # Get contact details
-            contacts = org_info.get("Contacts", {}).get("Contact", [])
-            if not isinstance(contacts, list):
-                contacts = [contacts]
-            
-            phone = next((c.get("value") for c in contacts if c.get("type") == "tel"), None)
-            
-            # Get all relationships
-            rels = org_info.get("Rels", {}).get("Rel", [])
-            if not isinstance(rels, list):
-                rels = [rels]
-            
-            # Get PCN relationships (RE8)
-            pcn_rels = [rel for rel in rels if rel.get("id") == "RE8"]
-            current_pcn = None
-            current_pcn_date = None
-            pcn_history = []
-            
-            for rel in pcn_rels:
-                target = rel.get("Target", {})
-                target_ods = target.get("OrgId", {}).get("extension")
-                
-                if target_ods in pcns:
-                    rel_dates = rel.get("Date", [])
-                    if not isinstance(rel_dates, list):
-                        rel_dates = [rel_dates]
-                    
-                    start_date = next((d.get("Start") for d in rel_dates if isinstance(d, dict)), None)
-                    end_date = next((d.get("End") for d in rel_dates if isinstance(d, dict)), None)
-                    
-                    pcn_history.append({
-                        'pcn_ods': target_ods,
-                        'pcn_name': pcns[target_ods]['name'],
-                        'status': rel.get("Status"),
-                        'start_date': start_date,
-                        'end_date': end_date
-                    })
-                    
-                    if rel.get("Status") == "Active" and not end_date:
-                        if not current_pcn or (start_date and start_date > current_pcn_date):
-                            current_pcn = target_ods
-                            current_pcn_date = start_date
-                            
-                            # Add to PCN's member practices
-                            pcns[target_ods]['member_practices'].append({
-                                'ods_code': ods_code,
-                                'name': org_info.get("Name"),
-                                'start_date': start_date
-                            })
-            
-            # Get role status
-            gp_role = next((role for role in roles if role.get("id") == "RO76"), None)
-            role_status = gp_role.get("Status") if gp_role else None
-            
-            # Use the ODS status directly instead of calculating it
-            practices.append({
-                'ODS Code': ods_code,
-                'Name': org_info.get("Name"),
-                'Status': org_info.get("Status"),  # Use ODS status directly
-                'Primary Role': next((role.get("id") for role in roles if role.get("primaryRole", False)), None),
-                'Operational Start': next((d.get("Start") for d in dates if d.get("Type") == "Operational"), None),
-                'Operational End': next((d.get("End") for d in dates if d.get("Type") == "Operational"), None),
-                'Legal Start': next((d.get("Start") for d in dates if d.get("Type") == "Legal"), None),
-                'Legal End': next((d.get("End") for d in dates if d.get("Type") == "Legal"), None),
-                'Address': location.get("AddrLn1"),
-                'Address Line 2': location.get("AddrLn2"),
-                'Town': location.get("Town"),
-                'County': location.get("County"),
-                'Postcode': location.get("PostCode"),
-                'UPRN': location.get("UPRN"),
-                'Phone': phone,
-                'Current PCN': pcns.get(current_pcn, {}).get('name') if current_pcn else None,
-                'Current PCN Code': current_pcn,
-                'PCN Member Since': current_pcn_date,
-                'PCN History': '; '.join(
-                    f"{h['pcn_name']} ({h['pcn_ods']}, {h['status']}, {h['start_date']}-{h['end_date'] if h['end_date'] else 'present'})"
-                    for h in sorted(pcn_history, key=lambda x: x['start_date'] or '')
-                ) if pcn_history else None,
-                'Last Changed': org_info.get("LastChangeDate")
-            })
+
+        if not is_practice:
+            continue
+
+        roles = record.roles
+
+        # Get contact details
+        phone = next((c.get("value") for c in record.contacts if c.get("type") == "tel"), None)
+
+        # Get PCN relationships (RE8)
+        pcn_rels = [rel for rel in record.rels if rel.get("id") == "RE8"]
+        current_pcn = None
+        current_pcn_date = None
+        pcn_history = []
+
+        for rel in pcn_rels:
+            target = rel.get("Target", {})
+            target_ods = target.get("OrgId", {}).get("extension")
+
+            if target_ods in pcn_codes:
+                rel_dates = as_list(rel.get("Date"))
+
+                start_date = next((d.get("Start") for d in rel_dates if isinstance(d, dict)), None)
+                end_date = next((d.get("End") for d in rel_dates if isinstance(d, dict)), None)
+
+                # Tuples ordered for C-level comparison: the leading
+                # sort key replaces the old key=lambda on a dict field
+                pcn_history.append((start_date or '', target_ods,
+                                    index.by_code[target_ods].name, rel.get("Status"),
+                                    start_date, end_date))
+
+                if rel.get("Status") == "Active" and not end_date:
+                    if not current_pcn or (start_date and start_date > current_pcn_date):
+                        current_pcn = target_ods
+                        current_pcn_date = start_date
+
+                        # Add to PCN's member practices
+                        pcn_members[target_ods].append({
+                            'ods_code': ods_code,
+                            'name': record.name,
+                            'start_date': start_date
+                        })
+
+        # Get role status
+        gp_role = _roles_by_id(roles).get("RO76")
+        role_status = gp_role.get("Status") if gp_role else None
+
+        # Use the ODS status directly instead of calculating it.
+        # Rows are tuples in PRACTICE_COLUMNS order: pandas adopts them
+        # without the per-row key hashing that dict records cost.
+        practices.append((
+            ods_code,
+            record.name,
+            record.status,  # Use ODS status directly
+            next((role.get("id") for role in roles if role.get("primaryRole", False)), None),
+            operational.get("Start"),
+            operational.get("End"),
+            legal.get("Start"),
+            legal.get("End"),
+            location.get("AddrLn1"),
+            location.get("AddrLn2"),
+            location.get("Town"),
+            location.get("County"),
+            location.get("PostCode"),
+            location.get("UPRN"),
+            phone,
+            index.by_code[current_pcn].name if current_pcn else None,
+            current_pcn,
+            current_pcn_date,
+            '; '.join(
+                f"{pcn_name} ({pcn_ods}, {status}, {start_date}-{end_date if end_date else 'present'})"
+                for _, pcn_ods, pcn_name, status, start_date, end_date in sorted(pcn_history)
+            ) if pcn_history else None,
+            record.last_changed
+        ))
+    
+    # Sort each member list once, rather than inside the frame generator;
+    # itemgetter avoids a Python-level lambda call per comparison
+    for members in pcn_members.values():
+        members.sort(key=itemgetter('name'))
     
     # Create DataFrames
-    practices_df = pd.DataFrame(practices)
+    practices_df = pd.DataFrame.from_records(practices, columns=PRACTICE_COLUMNS)
+    # Low-cardinality string columns: categorical codes sort as integers
+    # and xlsxwriter still writes them out as plain strings
+    practices_df = practices_df.astype({
+        'Status': 'category',
+        'Primary Role': 'category',
+        'Town': 'category',
+        'County': 'category',
+        'Current PCN': 'category'
+    })
+    # Arrow-backed strings store contiguously instead of as np.object
+    # pointers, cutting the frame's memory and speeding string sorts.
+    # Runs after the category casts: an all-null column (County, often)
+    # would otherwise become null[pyarrow], which astype('category')
+    # rejects, while the object->category path handles all-null fine.
+    practices_df = practices_df.convert_dtypes(dtype_backend='pyarrow')
     practices_df.sort_values(['Status', 'Name'], inplace=True)
-    practices_df.to_excel(writer, sheet_name='GP Practices', index=False)
-    
-    pcns_df = pd.DataFrame([{
-        'ODS Code': ods_code,
-        'Name': info['name'],
-        'Status': info['status'],
-        'Operational Start': info['operational_start'],
-        'Operational End': info['operational_end'],
-        'Legal Start': info['legal_start'],
-        'Legal End': info['legal_end'],
-        'Address': info['address'],
-        'Town': info['town'],
-        'Postcode': info['postcode'],
-        'UPRN': info['uprn'],
-        'Number of Member Practices': len(info['member_practices']),
-        'Member Practices': '; '.join(
-            f"{p['name']} ({p['ods_code']}, from {p['start_date']})"
-            for p in sorted(info['member_practices'], key=lambda x: x['name'])
-        ),
-        'Last Changed': info['last_changed']
-    } for ods_code, info in pcns.items()])
     
+    pcns_df = pd.DataFrame.from_records(
+        ((ods_code,
+          info['name'],
+          info['status'],
+          info['operational_start'],
+          info['operational_end'],
+          info['legal_start'],
+          info['legal_end'],
+          info['address'],
+          info['town'],
+          info['postcode'],
+          info['uprn'],
+          len(info['member_practices']),
+          '; '.join(
+              f"{p['name']} ({p['ods_code']}, from {p['start_date']})"
+              for p in info['member_practices']
+          ),
+          info['last_changed'])
+         for ods_code, info in pcns.items()),
+        columns=PCN_COLUMNS)
+    
+    pcns_df = pcns_df.astype({'Status': 'category', 'Town': 'category'})
+    pcns_df = pcns_df.convert_dtypes(dtype_backend='pyarrow')
     pcns_df.sort_values('Name', inplace=True)
-    pcns_df.to_excel(writer, sheet_name='PCNs', index=False)
     
-    writer.close()
-    print(f"Practice/PCN report saved to {excel_path}")
+    # Parquet is the primary artifact: an order of magnitude smaller than
+    # the workbook and far faster for downstream re-reads
+    practices_path = os.path.join("data", f"ncl_icb_practices_{timestamp}.parquet")
+    pcns_path = os.path.join("data", f"ncl_icb_pcns_{timestamp}.parquet")
+    practices_df.to_parquet(practices_path, engine='pyarrow', compression='zstd')
+    pcns_df.to_parquet(pcns_path, engine='pyarrow', compression='zstd')
+    print(f"Practice/PCN report saved to {practices_path} and {pcns_path}")
+    
+    if excel:
+        excel_path = os.path.join("data", f"ncl_icb_practices_pcns_{timestamp}.xlsx")
+        # constant_memory streams rows straight to disk instead of keeping a
+        # cell-object graph for the whole workbook; rows must be written in
+        # order, which the pre-sorted frames already guarantee
+        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter',
+                                engine_kwargs={'options': {'constant_memory': True}})
+        practices_df.to_excel(writer, sheet_name='GP Practices', index=False)
+        pcns_df.to_excel(writer, sheet_name='PCNs', index=False)
+        writer.close()
+        print(f"Excel report saved to {excel_path}")
 
-def analyze_data_structure(data):
+def analyze_data_structure(index, verbose=False):
     """Analyze and print details about the raw data structure"""
     print("\nAnalyzing Data Structure:")
     print("=========================")
     
-    # Count organizations by role
-    role_counts = defaultdict(int)
-    role_examples = {}
-    practice_count = 0
-    pcn_count = 0
-    active_practices = 0
-    inactive_practices = 0
-    
     print("\nScanning organizations...")
-    for ods_code, org_data in data["organisations"].items():
-        org_info = org_data.get("Organisation", {})
-        
-        # Get roles
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
-        
-        # Count roles and store examples
-        for role in roles:
-            role_id = role.get("id")
-            is_primary = role.get("primaryRole", False)
-            role_counts[f"{role_id} ({'Primary' if is_primary else 'Non-Primary'})"] += 1
-            
-            if role_id not in role_examples:
-                role_examples[role_id] = {
-                    'name': org_info.get("Name"),
-                    'ods_code': ods_code,
-                    'is_primary': is_primary
-                }
-        
-        # Count practices and PCNs
-        if any(role.get("id") == "RO76" for role in roles):
-            practice_count += 1
-            if org_info.get("Status") == "Active":
-                active_practices += 1
-            else:
-                inactive_practices += 1
-            
-            # If this is a practice, print its full structure
-            if practice_count == 1:
-                print("\nExample Practice Structure:")
-                print(json.dumps(org_info, indent=2))
-        
-        if any(role.get("id") == "RO272" and role.get("primaryRole", False) for role in roles):
-            pcn_count += 1
-            # If this is a PCN, print its full structure
-            if pcn_count == 1:
-                print("\nExample PCN Structure:")
-                print(json.dumps(org_info, indent=2))
+    # One row per (org, role): counting and example-picking become
+    # C-level groupby/drop_duplicates instead of Python dict loops
+    roles_df = pd.DataFrame.from_records(
+        ((record.ods_code, record.name, role.get("id"), bool(role.get("primaryRole", False)))
+         for record in index.orgs for role in record.roles),
+        columns=['ods_code', 'name', 'role_id', 'is_primary'])
+
+    active_practices = sum(1 for record in index.practices if record.status == "Active")
+    inactive_practices = len(index.practices) - active_practices
+
+    # Pretty-printing full example records is expensive and floods the
+    # console, so only do it when explicitly asked for
+    if verbose:
+        if index.practices:
+            print("\nExample Practice Structure:")
+            print(json.dumps(index.practices[0].org_info, indent=2))
+        if index.pcns:
+            print("\nExample PCN Structure:")
+            print(json.dumps(index.pcns[0].org_info, indent=2))
     
     print("\nSummary:")
-    print(f"Total organizations: {len(data['organisations'])}")
-    print(f"Total practices: {practice_count} (Active: {active_practices}, Inactive: {inactive_practices})")
-    print(f"Total PCNs: {pcn_count}")
+    print(f"Total organizations: {len(index.orgs)}")
+    print(f"Total practices: {len(index.practices)} (Active: {active_practices}, Inactive: {inactive_practices})")
+    print(f"Total PCNs: {len(index.pcns)}")
     
     print("\nRole distribution:")
-    for role, count in sorted(role_counts.items()):
-        example = role_examples.get(role.split()[0])
-        if example:
-            print(f"{role}: {count} organizations")
+    if not roles_df.empty:
+        role_counts = roles_df.groupby(['role_id', 'is_primary']).size()
+        role_examples = roles_df.drop_duplicates('role_id').set_index('role_id')
+        for (role_id, is_primary), count in sorted(role_counts.items()):
+            example = role_examples.loc[role_id]
+            print(f"{role_id} ({'Primary' if is_primary else 'Non-Primary'}): {count} organizations")
             print(f"  Example: {example['name']} ({example['ods_code']})")
     
     # Analyze relationships
     print("\nAnalyzing relationships...")
-    rel_types = defaultdict(int)
-    rel_examples = {}
-    
-    for ods_code, org_data in data["organisations"].items():
-        org_info = org_data.get("Organisation", {})
-        rels = org_info.get("Rels", {}).get("Rel", [])
-        if not isinstance(rels, list):
-            rels = [rels]
-        
-        for rel in rels:
-            rel_id = rel.get("id")
-            rel_types[rel_id] += 1
-            
-            if rel_id not in rel_examples:
-                target = rel.get("Target", {})
-                rel_examples[rel_id] = {
-                    'source': org_info.get("Name"),
-                    'source_ods': ods_code,
-                    'target_ods': target.get("OrgId", {}).get("extension"),
-                    'status': rel.get("Status")
-                }
+    rels_df = pd.DataFrame.from_records(
+        ((record.ods_code, record.name, rel.get("id"),
+          rel.get("Target", {}).get("OrgId", {}).get("extension"), rel.get("Status"))
+         for record in index.orgs for rel in record.rels),
+        columns=['source_ods', 'source', 'rel_id', 'target_ods', 'status'])
     
     print("\nRelationship types:")
-    for rel_id, count in sorted(rel_types.items()):
-        example = rel_examples.get(rel_id)
-        if example:
+    if not rels_df.empty:
+        rel_counts = rels_df['rel_id'].value_counts()
+        rel_examples = rels_df.drop_duplicates('rel_id').set_index('rel_id')
+        for rel_id, count in sorted(rel_counts.items()):
+            example = rel_examples.loc[rel_id]
             print(f"\n{rel_id}: {count} relationships")
             print(f"  Example: {example['source']} ({example['source_ods']}) -> {example['target_ods']}")
             print(f"  Status: {example['status']}")
 
-def analyze_practice_statuses(data):
+def analyze_practice_statuses(index):
     """Analyze practice statuses in detail"""
     print("\nAnalyzing Practice Statuses:")
     print("===========================")
     
     practices = []
-    for ods_code, org_data in data["organisations"].items():
-        org_info = org_data.get("Organisation", {})
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
-        
-        if any(role.get("id") == "RO76" for role in roles):
-            # Get dates
-            dates = org_info.get("Date", [])
-            if not isinstance(dates, list):
-                dates = [dates]
-            
-            operational_dates = [d for d in dates if d.get("Type") == "Operational"]
-            legal_dates = [d for d in dates if d.get("Type") == "Legal"]
-            
-            # Get role status
-            gp_role = next((role for role in roles if role.get("id") == "RO76"), None)
-            role_status = gp_role.get("Status") if gp_role else None
-            
-            practice = {
-                'ods_code': ods_code,
-                'name': org_info.get("Name"),
-                'org_status': org_info.get("Status"),
-                'role_status': role_status,
-                'operational_start': next((d.get("Start") for d in operational_dates), None),
-                'operational_end': next((d.get("End") for d in operational_dates), None),
-                'legal_start': next((d.get("Start") for d in legal_dates), None),
-                'legal_end': next((d.get("End") for d in legal_dates), None)
-            }
-            practices.append(practice)
+    for record in index.practices:
+        dates_by_type = _dates_by_type(record.dates)
+        operational = dates_by_type.get("Operational", {})
+        legal = dates_by_type.get("Legal", {})
+
+        # Get role status
+        gp_role = _roles_by_id(record.roles).get("RO76")
+        role_status = gp_role.get("Status") if gp_role else None
+
+        practice = {
+            'ods_code': record.ods_code,
+            'name': record.name,
+            'org_status': record.status,
+            'role_status': role_status,
+            'operational_start': operational.get("Start"),
+            'operational_end': operational.get("End"),
+            'legal_start': legal.get("Start"),
+            'legal_end': legal.get("End")
+        }
+        practices.append(practice)
     
-    # Analyze statuses
-    print("\nPractice Status Distribution:")
-    status_counts = defaultdict(int)
-    for p in practices:
-        key = f"Org: {p['org_status']}, Role: {p['role_status']}"
-        status_counts[key] += 1
+    practices_df = pd.DataFrame(practices)
+    if practices_df.empty:
+        print("\nNo practices found")
+        return
     
-    for status, count in status_counts.items():
-        print(f"{status}: {count} practices")
+    # One groupby drives both the distribution and the examples
+    status_groups = list(practices_df.groupby(['org_status', 'role_status'], dropna=False))
+    
+    print("\nPractice Status Distribution:")
+    for (org_status, role_status), group in status_groups:
+        print(f"Org: {org_status}, Role: {role_status}: {len(group)} practices")
     
     # Show examples of each status combination
     print("\nExample practices for each status combination:")
-    for status_combo in status_counts.keys():
-        examples = [p for p in practices 
-                   if f"Org: {p['org_status']}, Role: {p['role_status']}" == status_combo][:3]
-        print(f"\n{status_combo}:")
-        for ex in examples:
-            print(f"- {ex['name']} ({ex['ods_code']})")
-            print(f"  Operational: {ex['operational_start']} to {ex['operational_end'] or 'present'}")
-            print(f"  Legal: {ex['legal_start']} to {ex['legal_end'] or 'present'}")
+    for (org_status, role_status), group in status_groups:
+        print(f"\nOrg: {org_status}, Role: {role_status}:")
+        for ex in group.head(3).itertuples():
+            print(f"- {ex.name} ({ex.ods_code})")
+            print(f"  Operational: {ex.operational_start} to {ex.operational_end or 'present'}")
+            print(f"  Legal: {ex.legal_start} to {ex.legal_end or 'present'}")
     
     # Look for specific examples
     print("\nLooking for THE REGENTS PARK PRACTICE:")
-    regents = next((p for p in practices if p['name'] == "THE REGENTS PARK PRACTICE"), None)
-    if regents:
+    regents_df = practices_df[practices_df['name'] == "THE REGENTS PARK PRACTICE"]
+    if not regents_df.empty:
+        regents = regents_df.iloc[0]
         print(f"ODS Code: {regents['ods_code']}")
         print(f"Organisation Status: {regents['org_status']}")
         print(f"Role Status: {regents['role_status']}")
         print(f"Operational: {regents['operational_start']} to {regents['operational_end'] or 'present'}")
         print(f"Legal: {regents['legal_start']} to {regents['legal_end'] or 'present'}")
 
-def examine_specific_practices(data):
+def examine_specific_practices(index, verbose=False):
     """Examine specific practices in detail"""
     print("\nExamining Specific Practices:")
     print("============================")
     
     target_practices = ["THE REGENTS PARK PRACTICE"]
     
-    for ods_code, org_data in data["organisations"].items():
-        org_info = org_data.get("Organisation", {})
-        name = org_info.get("Name")
-        
-        if name in target_practices:
-            print(f"\nFound practice: {name}")
-            print("Raw data:")
-            print(json.dumps(org_info, indent=2))
-
-def analyze_practice_relationships(data):
+    for record in index.orgs:
+        if record.name in target_practices:
+            print(f"\nFound practice: {record.name}")
+            if verbose:
+                print("Raw data:")
+                print(json.dumps(record.org_info, indent=2))
+
+def analyze_practice_relationships(index):
     """Analyze practice relationships in detail"""
     print("\nAnalyzing Practice Relationships:")
     print("==============================")
     
     practices = []
-    for ods_code, org_data in data["organisations"].items():
-        org_info = org_data.get("Organisation", {})
-        roles = org_info.get("Roles", {}).get("Role", [])
-        if not isinstance(roles, list):
-            roles = [roles]
-        
-        if any(role.get("id") == "RO76" for role in roles):
-            # Get all relationships
-            rels = org_info.get("Rels", {}).get("Rel", [])
-            if not isinstance(rels, list):
-                rels = [rels]
-            
-            # Group relationships by type
-            rel_by_type = defaultdict(list)
-            for rel in rels:
-                rel_by_type[rel.get("id")].append({
-                    'target_ods': rel.get("Target", {}).get("OrgId", {}).get("extension"),
-                    'status': rel.get("Status"),
-                    'dates': rel.get("Date", []),
-                    'target_role': rel.get("Target", {}).get("PrimaryRoleId", {}).get("id")
-                })
-            
-            practices.append({
-                'ods_code': ods_code,
-                'name': org_info.get("Name"),
-                'status': org_info.get("Status"),
-                'relationships': dict(rel_by_type)
+    for record in index.practices:
+        # Group relationships by type
+        rel_by_type = defaultdict(list)
+        for rel in record.rels:
+            rel_by_type[rel.get("id")].append({
+                'target_ods': rel.get("Target", {}).get("OrgId", {}).get("extension"),
+                'status': rel.get("Status"),
+                'dates': rel.get("Date", []),
+                'target_role': rel.get("Target", {}).get("PrimaryRoleId", {}).get("id")
             })
+
+        practices.append({
+            'ods_code': record.ods_code,
+            'name': record.name,
+            'status': record.status,
+            'relationships': dict(rel_by_type)
+        })
     
     # Look for patterns in relationships
     print("\nAnalyzing relationship patterns:")
@@ -562,7 +685,7 @@ def analyze_practice_relationships(data):
             for rel_type, rels in practice['relationships'].items():
                 print(f"\n{rel_type}:")
                 for rel in rels:
-                    dates = rel['dates'] if isinstance(rel['dates'], list) else [rel['dates']]
+                    dates = as_list(rel['dates'])
                     for date in dates:
                         print(f"  Target: {rel['target_ods']} ({rel['target_role']})")
                         print(f"  Status: {rel['status']}")
@@ -570,18 +693,26 @@ def analyze_practice_relationships(data):
                         print(f"  End: {date.get('End', 'present')}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Build the practice/PCN report")
+    parser.add_argument('--excel', action='store_true',
+                        help="Also write the Excel workbook alongside the parquet files")
+    args = parser.parse_args()
+
     icb_code = "93C"  # North Central London ICB
     
     # Load or fetch the data
     data = load_or_fetch_data(icb_code)
-    
+
+    # Build the shared indexes once; the analyzers and report all work
+    # from the same normalised records
+    index = build_indexes(data)
+
     # Analyze practice relationships
-    analyze_practice_relationships(data)
+    analyze_practice_relationships(index)
     
     # Create practice/PCN report
     timestamp = datetime.now().strftime("%Y%m%d")
-    report_filename = f"ncl_icb_practices_pcns_{timestamp}.xlsx"
-    create_practice_pcn_report(data, report_filename)
+    create_practice_pcn_report(index, timestamp, excel=args.excel)
 
 if __name__ == "__main__":
     main()
@@ -1,122 +1,172 @@
-import json
+import orjson
 import os
+from collections import Counter
 from datetime import datetime
 from glob import glob
-from utils import setup_logging, get_pcn_name
+from operator import itemgetter
+from utils import setup_logging, load_ods_data
 
 logger = setup_logging()
 
+# C-level field access for the classification pass
+_role_id = itemgetter('id')
+
 def load_latest_data():
-    """Load the most recent data file"""
+    """Load the most recent data file
+
+    Returns (data, latest_file, sorted_files) so callers can reach the
+    previous snapshot without globbing the directory again.
+    """
     try:
-        data_files = glob('data/ncl_icb_data_*.json')
+        data_files = glob('data/ncl_icb_data_*.json') + glob('data/ncl_icb_data_*.jsonl')
         if not data_files:
             logger.warning("No data files found in data directory")
-            return None, None
+            return None, None, []
         
-        latest_file = max(data_files)
-        with open(latest_file, 'r') as f:
-            return json.load(f), latest_file
+        # Timestamped filenames sort chronologically
+        sorted_files = sorted(data_files)
+        latest_file = sorted_files[-1]
+        return load_ods_data(latest_file), latest_file, sorted_files
     except Exception as e:
         logger.error(f"Error loading latest data: {e}")
-        return None, None
+        return None, None, []
 
-def load_previous_data(current_file):
-    """Load the previous data file"""
+def load_previous_data(sorted_files):
+    """Load the previous data file from the already-sorted file list"""
     try:
-        data_files = glob('data/ncl_icb_data_*.json')
-        if len(data_files) < 2:
+        if len(sorted_files) < 2:
             logger.warning("No previous data file found")
             return None, None
         
-        # Sort files and get the second most recent
-        sorted_files = sorted(data_files)
-        prev_file_idx = sorted_files.index(current_file) - 1
-        if prev_file_idx < 0:
-            logger.warning("No previous file found")
-            return None, None
-        
-        with open(sorted_files[prev_file_idx], 'r') as f:
-            return json.load(f), sorted_files[prev_file_idx]
+        previous_file = sorted_files[-2]
+        return load_ods_data(previous_file), previous_file
     except Exception as e:
         logger.error(f"Error loading previous data: {e}")
         return None, None
 
-def detect_practice_changes(old_data, new_data):
-    """Detect changes in GP Practices"""
-    changes = []
+def _classify(data):
+    """Return (practice_codes, pcn_codes) sets for a dataset"""
+    practices = set()
+    pcns = set()
+    for ods_code, org in data.get("organisations", {}).items():
+        roles = org.get("Organisation", {}).get("Roles", {}).get("Role", [])
+        role_ids = frozenset(map(_role_id, roles))
+        if "RO76" in role_ids:
+            practices.add(ods_code)
+        # The primaryRole scan only runs for the few orgs that carry
+        # RO272 at all; everything else is settled by set membership
+        if "RO272" in role_ids and any(
+                role.get("primaryRole", False) for role in roles
+                if role.get("id") == "RO272"):
+            pcns.add(ods_code)
+    return practices, pcns
+
+def _mk(change_type, ods_code, name, date_of_change, **extra):
+    """Build a change record; the common keys are laid down once here"""
+    record = {
+        "type": change_type,
+        "ods_code": ods_code,
+        "name": name,
+        "date_of_change": date_of_change
+    }
+    record.update(extra)
+    return record
+
+def detect_changes(old_data, new_data):
+    """Detect practice and PCN changes in a single pass over the orgs"""
+    practice_changes = []
+    pcn_changes = []
     
     old_orgs = old_data.get("organisations", {})
     new_orgs = new_data.get("organisations", {})
     
-    # Check all practices in both old and new data
-    all_ods_codes = set(old_orgs.keys()) | set(new_orgs.keys())
+    # Classify each dataset up front so the diff loop only visits
+    # practices and PCNs, not every organisation, and the role scan
+    # disappears from the hot loop. Classifying the old snapshot too
+    # means orgs that vanished from the new dump are still diffed.
+    old_practices, old_pcns = _classify(old_data)
+    new_practices, new_pcns = _classify(new_data)
+    practice_codes = old_practices | new_practices
+    pcn_codes = old_pcns | new_pcns
+    
+    # Name each PCN once per dataset; pcn_change records then resolve
+    # names with a flat dict lookup instead of four chained .get() calls
+    old_pcn_names = {code: old_orgs.get(code, {}).get("Organisation", {}).get("Name")
+                     for code in old_pcns}
+    new_pcn_names = {code: new_orgs.get(code, {}).get("Organisation", {}).get("Name")
+                     for code in new_pcns}
     
-    for ods_code in all_ods_codes:
+    for ods_code in practice_codes | pcn_codes:
         old_org = old_orgs.get(ods_code, {}).get("Organisation", {})
         new_org = new_orgs.get(ods_code, {}).get("Organisation", {})
         
-        # Skip if not a practice
-        if not any(role.get("id") == "RO76" for role in new_org.get("Roles", {}).get("Role", []) or []):
+        # An org whose LastChangeDate is identical in both snapshots
+        # cannot have changed; in a typical daily diff that skips the
+        # status and PCN comparisons for nearly every org
+        if (old_org and new_org and
+                old_org.get("LastChangeDate") == new_org.get("LastChangeDate")):
             continue
         
-        # New practice
+        is_practice = ods_code in practice_codes
+        is_pcn = ods_code in pcn_codes
+        
+        # New organisation
         if not old_org:
-            changes.append({
-                "type": "new_practice",
-                "ods_code": ods_code,
-                "name": new_org.get("Name"),
-                "date_of_change": new_org.get("LastChangeDate")
-            })
+            if is_practice:
+                practice_changes.append(_mk(
+                    "new_practice", ods_code,
+                    new_org.get("Name"), new_org.get("LastChangeDate")))
+            if is_pcn:
+                pcn_changes.append(_mk(
+                    "new_pcn", ods_code,
+                    new_org.get("Name"), new_org.get("LastChangeDate")))
             continue
             
-        # Closed practice
+        # Closed organisation
         if not new_org:
-            changes.append({
-                "type": "closed_practice",
-                "ods_code": ods_code,
-                "name": old_org.get("Name"),
-                "date_of_change": old_org.get("LastChangeDate")
-            })
+            if is_practice:
+                practice_changes.append(_mk(
+                    "closed_practice", ods_code,
+                    old_org.get("Name"), old_org.get("LastChangeDate")))
+            if is_pcn:
+                pcn_changes.append(_mk(
+                    "closed_pcn", ods_code,
+                    old_org.get("Name"), old_org.get("LastChangeDate")))
             continue
         
         # Status change
         if old_org.get("Status") != new_org.get("Status"):
-            changes.append({
-                "type": "status_change",
-                "ods_code": ods_code,
-                "name": new_org.get("Name"),
-                "old_status": old_org.get("Status"),
-                "new_status": new_org.get("Status"),
-                "date_of_change": new_org.get("LastChangeDate")
-            })
+            status_change = _mk(
+                "status_change", ods_code,
+                new_org.get("Name"), new_org.get("LastChangeDate"),
+                old_status=old_org.get("Status"),
+                new_status=new_org.get("Status"))
+            if is_practice:
+                practice_changes.append(status_change)
+            if is_pcn:
+                pcn_changes.append(status_change)
         
-        # PCN membership change
-        old_pcn = get_current_pcn(old_org)
-        new_pcn = get_current_pcn(new_org)
-        
-        if old_pcn != new_pcn:
-            changes.append({
-                "type": "pcn_change",
-                "ods_code": ods_code,
-                "name": new_org.get("Name"),
-                "old_pcn": old_pcn,
-                "old_pcn_name": get_pcn_name(old_data, old_pcn),
-                "new_pcn": new_pcn,
-                "new_pcn_name": get_pcn_name(new_data, new_pcn),
-                "date_of_change": new_org.get("LastChangeDate")
-            })
+        # PCN membership change (practices only)
+        if is_practice:
+            old_pcn = get_current_pcn(old_org)
+            new_pcn = get_current_pcn(new_org)
+            
+            if old_pcn != new_pcn:
+                practice_changes.append(_mk(
+                    "pcn_change", ods_code,
+                    new_org.get("Name"), new_org.get("LastChangeDate"),
+                    old_pcn=old_pcn,
+                    old_pcn_name=old_pcn_names.get(old_pcn),
+                    new_pcn=new_pcn,
+                    new_pcn_name=new_pcn_names.get(new_pcn)))
     
-    return changes
+    return practice_changes, pcn_changes
 
 def get_current_pcn(org_data):
     """Get current PCN for a practice"""
     try:
-        rels = org_data.get("Rels", {}).get("Rel", [])
-        if not isinstance(rels, list):
-            rels = [rels]
-        
-        for rel in rels:
+        # Rel is normalised to a list at load time
+        for rel in org_data.get("Rels", {}).get("Rel", []):
             if (rel.get("Target", {}).get("PrimaryRoleId", {}).get("id") == "RO272" and
                 rel.get("Status") == "Active" and
                 not any(d.get("End") for d in rel.get("Date", []))):
@@ -126,99 +176,65 @@ def get_current_pcn(org_data):
         logger.error(f"Error getting current PCN: {e}")
         return None
 
-def detect_pcn_changes(old_data, new_data):
-    """Detect changes in PCNs"""
+def load_tracked_changes():
+    """Load the accumulated change history into {"changes": [...]}
+
+    Reads the append-only tracked_changes.jsonl (one run per line) and,
+    for continuity, any legacy tracked_changes.json written by earlier
+    versions.
+    """
     changes = []
-    
-    old_orgs = old_data.get("organisations", {})
-    new_orgs = new_data.get("organisations", {})
-    
-    # Check all PCNs in both old and new data
-    all_ods_codes = set(old_orgs.keys()) | set(new_orgs.keys())
-    
-    for ods_code in all_ods_codes:
-        old_org = old_orgs.get(ods_code, {}).get("Organisation", {})
-        new_org = new_orgs.get(ods_code, {}).get("Organisation", {})
-        
-        # Skip if not a PCN
-        if not any(role.get("id") == "RO272" and role.get("primaryRole", False) 
-                  for role in new_org.get("Roles", {}).get("Role", []) or []):
-            continue
-        
-        # New PCN
-        if not old_org:
-            changes.append({
-                "type": "new_pcn",
-                "ods_code": ods_code,
-                "name": new_org.get("Name"),
-                "date_of_change": new_org.get("LastChangeDate")
-            })
-            continue
-            
-        # Closed PCN
-        if not new_org:
-            changes.append({
-                "type": "closed_pcn",
-                "ods_code": ods_code,
-                "name": old_org.get("Name"),
-                "date_of_change": old_org.get("LastChangeDate")
-            })
-            continue
-        
-        # Status change
-        if old_org.get("Status") != new_org.get("Status"):
-            changes.append({
-                "type": "status_change",
-                "ods_code": ods_code,
-                "name": new_org.get("Name"),
-                "old_status": old_org.get("Status"),
-                "new_status": new_org.get("Status"),
-                "date_of_change": new_org.get("LastChangeDate")
-            })
-    
-    return changes
+    legacy_path = 'data/tracked_changes.json'
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            changes.extend(orjson.loads(f.read()).get("changes", []))
+    jsonl_path = 'data/tracked_changes.jsonl'
+    if os.path.exists(jsonl_path):
+        with open(jsonl_path, 'rb') as f:
+            changes.extend(orjson.loads(line) for line in f)
+    return {"changes": changes}
 
 def update_tracked_changes(changes, current_file):
-    """Update the tracked_changes.json file"""
+    """Append this run's changes to the tracked_changes.jsonl history"""
     try:
-        tracked_changes_path = 'data/tracked_changes.json'
-        
-        if os.path.exists(tracked_changes_path):
-            with open(tracked_changes_path, 'r') as f:
-                tracked_changes = json.load(f)
-        else:
-            tracked_changes = {"changes": []}
+        tracked_changes_path = 'data/tracked_changes.jsonl'
         
         # Add new changes with summary statistics
         if changes["practice_changes"] or changes["pcn_changes"]:
+            # One Counter pass per list replaces seven filtering
+            # comprehensions over the same changes
+            practice_counts = Counter(c["type"] for c in changes["practice_changes"])
+            pcn_counts = Counter(c["type"] for c in changes["pcn_changes"])
             summary = {
                 "total_changes": len(changes["practice_changes"]) + len(changes["pcn_changes"]),
                 "practice_changes": {
                     "total": len(changes["practice_changes"]),
-                    "new": len([c for c in changes["practice_changes"] if c["type"] == "new_practice"]),
-                    "closed": len([c for c in changes["practice_changes"] if c["type"] == "closed_practice"]),
-                    "status": len([c for c in changes["practice_changes"] if c["type"] == "status_change"]),
-                    "pcn": len([c for c in changes["practice_changes"] if c["type"] == "pcn_change"])
+                    "new": practice_counts["new_practice"],
+                    "closed": practice_counts["closed_practice"],
+                    "status": practice_counts["status_change"],
+                    "pcn": practice_counts["pcn_change"]
                 },
                 "pcn_changes": {
                     "total": len(changes["pcn_changes"]),
-                    "new": len([c for c in changes["pcn_changes"] if c["type"] == "new_pcn"]),
-                    "closed": len([c for c in changes["pcn_changes"] if c["type"] == "closed_pcn"]),
-                    "status": len([c for c in changes["pcn_changes"] if c["type"] == "status_change"])
+                    "new": pcn_counts["new_pcn"],
+                    "closed": pcn_counts["closed_pcn"],
+                    "status": pcn_counts["status_change"]
                 }
             }
             
-            tracked_changes["changes"].append({
+            entry = {
                 "date": datetime.now().strftime("%Y-%m-%d"),
                 "data_file": os.path.basename(current_file),
                 "summary": summary,
                 "practice_changes": changes["practice_changes"],
                 "pcn_changes": changes["pcn_changes"]
-            })
+            }
             
-            # Save updated changes
-            with open(tracked_changes_path, 'w') as f:
-                json.dump(tracked_changes, f, indent=2)
+            # Append this run as one line: O(entry) regardless of how
+            # much history has accumulated, instead of rewriting the
+            # whole pretty-printed document every run
+            with open(tracked_changes_path, 'ab') as f:
+                f.write(orjson.dumps(entry) + b'\n')
             logger.info(f"Changes saved to {tracked_changes_path}")
             
             # Log summary
@@ -235,20 +251,19 @@ def update_tracked_changes(changes, current_file):
 def main():
     try:
         # Load latest data
-        latest_data, latest_file = load_latest_data()
+        latest_data, latest_file, sorted_files = load_latest_data()
         if not latest_data:
             return
         
         # Load previous data
-        previous_data, previous_file = load_previous_data(latest_file)
+        previous_data, previous_file = load_previous_data(sorted_files)
         if not previous_data:
             return
         
         logger.info(f"Comparing {os.path.basename(previous_file)} with {os.path.basename(latest_file)}")
         
         # Detect changes
-        practice_changes = detect_practice_changes(previous_data, latest_data)
-        pcn_changes = detect_pcn_changes(previous_data, latest_data)
+        practice_changes, pcn_changes = detect_changes(previous_data, latest_data)
         
         changes = {
             "practice_changes": practice_changes,
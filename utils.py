@@ -1,9 +1,19 @@
 import logging
+import mmap
 import os
+import orjson
 from datetime import datetime
 
+_LOGGER = None
+
 def setup_logging():
     """Setup logging configuration"""
+    # Module-level singleton: every importing module calls this at load,
+    # so skip the makedirs syscall and handler setup after the first time
+    global _LOGGER
+    if _LOGGER is not None:
+        return _LOGGER
+
     # Create logs directory if it doesn't exist
     os.makedirs('logs', exist_ok=True)
     
@@ -19,8 +29,57 @@ def setup_logging():
             logging.StreamHandler()
         ]
     )
-    
-    return logging.getLogger(__name__)
+
+    _LOGGER = logging.getLogger(__name__)
+    return _LOGGER
+
+def as_list(value):
+    """Normalise an ODS field that may be a single object, a list or missing"""
+    # type() rather than isinstance(): the field is never a list subclass
+    return value if type(value) is list else ([] if value is None else [value])
+
+def _normalise_org(org):
+    """Coerce single-object Role/Rel fields to lists in place
+
+    Downstream code can then iterate them directly without per-call
+    isinstance checks or `or []` fallbacks.
+    """
+    organisation = org.get("Organisation")
+    if organisation:
+        roles = organisation.get("Roles")
+        if roles is not None and "Role" in roles:
+            roles["Role"] = as_list(roles["Role"])
+        rels = organisation.get("Rels")
+        if rels is not None and "Rel" in rels:
+            rels["Rel"] = as_list(rels["Rel"])
+    return org
+
+def load_ods_data(filepath):
+    """Load a saved ODS data file into {"metadata": ..., "organisations": ...}
+
+    Supports both the original single-document .json files and the
+    line-delimited .jsonl files written by newer runs (metadata on the
+    first line, then one organisation record per line).
+    """
+    with open(filepath, 'rb') as f:
+        if not filepath.endswith('.jsonl'):
+            # Parse straight from a read-only mapping: skips copying the
+            # whole multi-MB document into a bytes object first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = orjson.loads(memoryview(mm))
+            for org in data.get("organisations", {}).values():
+                _normalise_org(org)
+            return data
+
+        metadata = {}
+        organisations = {}
+        for line in f:
+            record = orjson.loads(line)
+            if "metadata" in record:
+                metadata = record["metadata"]
+            else:
+                organisations[record["ods_code"]] = _normalise_org(record["data"])
+        return {"metadata": metadata, "organisations": organisations}
 
 def validate_org_data(org_data):
     """Validate organization data structure"""